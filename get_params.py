@@ -251,7 +251,8 @@ def instantiate_model(model_config: Dict) -> object:
     try:
         module_name, class_name = model_config["model_import_path"].rsplit(".", 1)
         ModelClass = getattr(importlib.import_module(module_name), class_name)
-        model_params = model_config["model_params"]
+        # copy so model_path stays in the config the llm cache is keyed by
+        model_params = dict(model_config["model_params"])
         inference_function_name = model_config["model_inference_function"]
         if inference_function_name != "":
             inference_function = getattr(ModelClass, inference_function_name)
@@ -27,8 +27,25 @@ import logging
 import re
 import math
 import json
+import os
+import shelve
+import hashlib
+import string
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Dict, List, Tuple
 
+BLANK_LINES_RE = re.compile(r"\n\s*\n")
+# Instructions left out of the Q and A pairs given to the LLM as additional context
+EXCLUDED_INSTRUCTIONS = ("Call code graph", "Docstring")
+# Exact match cache of llm outputs keyed by prompt, disabled with PY2DATASET_CACHE=0
+LLM_CACHE_FILE = os.path.expanduser("~/.py2dataset_llm_cache")
+LLM_CACHE_LOCK = threading.Lock()
+SEMANTIC_CACHE = None
+SEMANTIC_CACHE_UNAVAILABLE = False
+
 
 def group_json(input_json: Dict) -> Dict:
     """
@@ -52,6 +69,154 @@ def group_json(input_json: Dict) -> Dict:
     return output_json
 
 
+def read_llm_cache(key: str):
+    """
+    Read a cached llm output.
+    Args:
+        key (str): The cache key of the prompt.
+    Returns:
+        The cached llm output, or None if not cached.
+    """
+    try:
+        with LLM_CACHE_LOCK, shelve.open(LLM_CACHE_FILE, flag="r") as cache:
+            return cache.get(key)
+    except Exception:  # cache file does not exist yet or cannot be read
+        return None
+
+
+def write_llm_cache(key: str, output) -> None:
+    """
+    Write an llm output to the cache.
+    Args:
+        key (str): The cache key of the prompt.
+        output: The llm output to be cached.
+    Returns:
+        None
+    """
+    try:
+        with LLM_CACHE_LOCK, shelve.open(LLM_CACHE_FILE) as cache:
+            cache[key] = output
+    except Exception as error:
+        logging.info("Failed to write llm cache: %s", error)
+
+
+class SemanticCache:
+    """
+    In-memory cache of llm outputs looked up by embedding similarity. Entries are
+    grouped by scope, so only outputs for the same scope, such as the same code,
+    can be reused.
+    Attributes:
+        encoder (SentenceTransformer): The model used to embed cache keys.
+        new_index (Callable[[], faiss.IndexFlatIP]): Creates the index of a scope.
+        scopes (Dict[str, Tuple[faiss.IndexFlatIP, List[str]]]): Inner product index
+        of normalized key embeddings and the cached llm outputs in index order by scope.
+        threshold (float): Minimum cosine similarity for a cache hit.
+    """
+
+    def __init__(self, encoder_name: str, threshold: float) -> None:
+        from sentence_transformers import SentenceTransformer
+        import faiss
+
+        self.encoder = SentenceTransformer(encoder_name)
+        self.new_index = functools.partial(
+            faiss.IndexFlatIP, self.encoder.get_sentence_embedding_dimension()
+        )
+        self.scopes = {}
+        self.threshold = threshold
+        self.lock = threading.Lock()
+
+    def embed(self, text: str):
+        """Return the normalized embedding of text as a 1 x dim float32 array."""
+        return self.encoder.encode([text], normalize_embeddings=True).astype("float32")
+
+    def get(self, scope: str, embedding):
+        """Return the cached output of scope most similar to embedding, or None."""
+        with self.lock:
+            if scope not in self.scopes:
+                return None
+            index, outputs = self.scopes[scope]
+            scores, ids = index.search(embedding, 1)
+        return outputs[ids[0][0]] if scores[0][0] >= self.threshold else None
+
+    def add(self, scope: str, embedding, output) -> None:
+        """Add an llm output to the cache of scope."""
+        with self.lock:
+            index, outputs = self.scopes.setdefault(scope, (self.new_index(), []))
+            index.add(embedding)
+            outputs.append(output)
+
+
+def get_semantic_cache(model_config: Dict):
+    """
+    Get the process wide semantic cache if enabled in the model config.
+    Args:
+        model_config (Dict): Configuration for the language model. The cache is
+        enabled with `semantic_cache: true` and tuned with the optional
+        `semantic_cache_threshold` and `semantic_cache_encoder` keys.
+    Returns:
+        SemanticCache: The semantic cache, or None if disabled or unavailable.
+    """
+    global SEMANTIC_CACHE, SEMANTIC_CACHE_UNAVAILABLE
+    if not model_config.get("semantic_cache") or SEMANTIC_CACHE_UNAVAILABLE:
+        return None
+    if SEMANTIC_CACHE is None:
+        try:
+            SEMANTIC_CACHE = SemanticCache(
+                model_config.get("semantic_cache_encoder", "all-MiniLM-L6-v2"),
+                model_config.get("semantic_cache_threshold", 0.95),
+            )
+        except Exception as error:  # missing dependency or encoder cannot be loaded
+            logging.info("Semantic cache disabled, failed to load: %s", error)
+            SEMANTIC_CACHE_UNAVAILABLE = True
+            return None
+    return SEMANTIC_CACHE
+
+
+def join_stream(chunks, repeat_limit: int) -> str:
+    """
+    Join streamed llm output, stopping the stream early if the output degenerates
+    into the same line repeated over and over.
+    Args:
+        chunks (Iterable[str]): The streamed llm output chunks.
+        repeat_limit (int): Number of repeats of a non-blank line that stops the stream,
+        no limit if below 1.
+    Returns:
+        str: The joined llm output, without the repeats if the stream was stopped.
+    """
+    lines, current, repeats = [], [], 0
+    for chunk in chunks:
+        *completed, rest = chunk.split("\n")
+        if not completed:
+            current.append(rest)
+            continue
+        completed[0] = "".join(current) + completed[0]
+        current = [rest]
+        for line in completed:
+            repeats = repeats + 1 if line.strip() and lines and line == lines[-1] else 0
+            lines.append(line)
+            if 0 < repeat_limit <= repeats:
+                logging.info("Stopped llm output repeating: %s", line)
+                if hasattr(chunks, "close"):
+                    chunks.close()
+                return "\n".join(lines[:-repeats])
+    lines.append("".join(current))
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def get_question_fields(question_text: str) -> frozenset:
+    """
+    Get the replacement field names used in a question text, parsed once per text.
+    Args:
+        question_text (str): The question text format string.
+    Returns:
+        frozenset: The replacement field names in the question text.
+    """
+    return frozenset(
+        field for _, field, _, _ in string.Formatter().parse(question_text) if field
+    )
+
+
 def clean_and_get_unique_elements(input_str: str) -> str:
     """
     Clean an input string (str) and return a string of unique elements.
@@ -62,24 +227,46 @@ def clean_and_get_unique_elements(input_str: str) -> str:
     """
 
     def element_generator(input_str):
-        start, brace_level = 0, 0
-        for i, char in enumerate(input_str):
-            if char in "{}":
-                brace_level += 1 if char == "{" else -1
-            elif char == "," and brace_level == 0:
-                yield input_str[start:i]
-                start = i + 1
-        yield input_str[start:]
+        # split on every comma, then rejoin the parts that fall inside braces
+        parts, brace_level = [], 0
+        for part in input_str.split(","):
+            parts.append(part)
+            brace_level += part.count("{") - part.count("}")
+            if brace_level == 0:
+                yield ",".join(parts)
+                parts = []
+        if parts:
+            yield ",".join(parts)
 
     input_str = input_str.strip("[]'\"").strip()
+    # without braces every comma is a separator, so let str.split do the scan
+    if "{" in input_str or "}" in input_str:
+        elements = element_generator(input_str)
+    else:
+        elements = input_str.split(",")
     cleaned_elements = [
-        element.strip("'\" ").strip()
-        for element in element_generator(input_str)
-        if element.strip()
+        element.strip("'\" ").strip() for element in elements if element.strip()
     ]
     return ", ".join(cleaned_elements)
 
 
+@dataclass
+class Instruct:
+    """
+    Instruction-input-output triplet generated for a question. The records are
+    converted to JSON objects by save_output.write_file as they are written.
+    Attributes:
+        instruction (str): The question query.
+        input (str): The context of the question.
+        output (str): The response to the question.
+    """
+
+    __slots__ = ("instruction", "input", "output")
+    instruction: str
+    input: str
+    output: str
+
+
 class DatasetGenerator:
     """
     Generate JSON formatted dictionary outputs for a Python file.
@@ -88,27 +275,80 @@ class DatasetGenerator:
         file_details (Dict[str, Any]): Details of the Python file.
         base_name (str): The base name of the Python file.
         questions (List[Dict[str, str]]): Questions for generating responses.
-        instruct_list (List[Dict[str, str]]): Storage for generated instructions.
+        instruct_list (List[Instruct]): Storage for generated instructions.
+        code_qa_list (List[Dict[str, str]]): Q and A pairs used as additional llm context.
         question_mapping (Dict[str, str]): Mapping of question types to keys in file details.
+        question_targets (Dict[str, List[Tuple]]): Code elements by question type.
+        purpose_strings (Dict[Tuple[str, str, str], str]): Purpose question strings by code element.
         use_llm (bool): Flag indicating if a language model should be used.
         llm (object): The language model for generating responses.
+        max_context_length (int): The context length of the language model.
+        llm_cache_model (str): The serialized model and stream configuration keying
+        the llm cache.
         prompt (str): The prompt format for querying the language model.
+        file_info (Dict[str, Any]): The file level details of the Python file.
+        file_code_simplified (str): The simplified code of the Python file.
+        file_code_context (str): The fenced Python file code used as file context.
     Methods:
-        add_to_list(list_to_update: List[Dict], query: str, response: str,
-        additional_field=None) -> List[Dict]:
+        add_to_list(list_to_update: List[Instruct], query: str, response: str,
+        additional_field=None) -> List[Instruct]:
             Add response to the instruct list.
+        get_llm_output(prompt: str, semantic_key: Tuple[str, str] = None) -> str:
+            Get language model output for a prompt, using the llm caches.
         get_response_from_llm(query: str, context: str) -> str:
             Get language model response to query for given context.
+        get_overall_response(query: str, context: str,
+        code_qa_list: List[Dict[str, str]]) -> Tuple[str, str]:
+            Get the language model output for a query and the context used.
+        complete_response(overall_response: Tuple[str, str],
+        code_qa_list: List[Dict[str, str]]) -> str:
+            Add the code elements and detailed responses to a language model output.
+        update_detailed_responses(context: str,
+        code_qa_list: List[Dict[str, str]]) -> None:
+            Add the purpose and significance of each code_qa_list item.
         process_question(question_type: str, question_id: str, query: str,
         context: str, info: Dict) -> None:
             Process question and add generated response to the instruct_list.
+        add_response(question_type: str, query: str, context: str, response,
+        position: Tuple[int, int] = None) -> None:
+            Add a question response to the instruct_list.
+        get_question_targets() -> Dict[str, List[Tuple[Dict, str, Dict]]]:
+            Get the code elements each question type is asked about.
+        get_purpose_string(question_type: str, name: str, info: Dict,
+        field: str) -> str:
+            Get the variables or methods string of a function or class.
         process_question_type(question_type: str, question_id: str,
         question_text: str) -> None:
             Process question related to file, function, class, or method.
-        generate() -> Tuple[List[Dict], List[Dict]]:
+        generate() -> List[Instruct]:
             Generate responses for all the questions and return the instruct_list.
     """
 
+    __slots__ = (
+        "file_path",
+        "file_details",
+        "base_name",
+        "questions",
+        "model_config",
+        "llm",
+        "use_llm",
+        "detailed",
+        "max_context_length",
+        "semantic_cache",
+        "max_concurrency",
+        "llm_semaphore",
+        "llm_cache_model",
+        "file_info",
+        "file_code_simplified",
+        "file_code_context",
+        "deferred_questions",
+        "instruct_list",
+        "code_qa_list",
+        "question_mapping",
+        "question_targets",
+        "purpose_strings",
+    )
+
     def __init__(
         self,
         file_path: str,
@@ -134,44 +374,108 @@ class DatasetGenerator:
         self.base_name = base_name
         self.questions = questions
         self.model_config = model_config
-        if model_config is not None:
-            self.llm = model_config["model"]
-            self.use_llm = True
-            self.detailed = detailed
-        else:
-            self.llm = None
-            self.use_llm = False
-            self.detailed = False
+        self.llm = model_config.get("model") if model_config else None
+        self.use_llm = self.llm is not None
+        self.detailed = detailed and self.use_llm
+        self.max_context_length = (
+            model_config["inference_model"]["model_params"]["context_length"]
+            if self.use_llm
+            else 0
+        )
+        self.semantic_cache = get_semantic_cache(model_config) if self.use_llm else None
+        self.max_concurrency = (
+            model_config.get("max_concurrency", 1) if self.use_llm else 1
+        )
+        if self.max_concurrency < 1:
+            logging.warning("Invalid max_concurrency %s, using 1", self.max_concurrency)
+            self.max_concurrency = 1
+        self.llm_semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self.llm_cache_model = ""
+        if self.use_llm:
+            cache_model = model_config["inference_model"]
+            if model_config.get("stream"):  # streamed outputs can be stopped early
+                cache_model = {
+                    "inference_model": cache_model,
+                    "stream_repeat_limit": model_config.get("stream_repeat_limit", 5),
+                }
+            self.llm_cache_model = json.dumps(cache_model, sort_keys=True, default=str)
+        self.file_info = file_details["file_info"]
+        self.file_code_simplified = str(self.file_info["file_code_simplified"])
+        self.file_code_context = f"```python\n{self.file_info['file_code']}\n```"
+        self.deferred_questions = []
         self.instruct_list = []
+        self.code_qa_list = []
         self.question_mapping = {
             "file": "file",
             "function": "functions",
             "class": "classes",
             "method": "classes",
         }
+        self.question_targets = self.get_question_targets()
+        self.purpose_strings = {}
 
     def add_to_list(
         self,
-        list_to_update: List[Dict],
+        list_to_update: List[Instruct],
         query: str,
         response: str,
         additional_field=None,
-    ) -> List[Dict]:
+    ) -> List[Instruct]:
         """
         Add response to the instruct list.
         Args:
-            list_to_update (List[Dict]): The list to update.
+            list_to_update (List[Instruct]): The list to update.
             query (str): The query to be added.
             response (str): The response to be added.
             additional_field (Any): Additional field to be added.
         Returns:
-            List[Dict]: The updated list.
+            List[Instruct]: The updated list.
         """
-        list_to_update.append(
-            {"instruction": query, "input": additional_field, "output": response}
-        )
+        list_to_update.append(Instruct(query, additional_field, response))
         return list_to_update
 
+    def get_llm_output(self, prompt: str, semantic_key: Tuple[str, str] = None) -> str:
+        """
+        Get language model output for a prompt, reusing the cached output of an
+        identical prompt or, if the semantic cache is enabled, of a similar semantic_key.
+        Args:
+            prompt (str): The prompt to be sent to the language model.
+            semantic_key (Tuple[str, str]): The scope, a hash of the code the request
+            is about, and the query text of the request for the semantic cache.
+        Returns:
+            str: The language model output with runs of blank lines collapsed.
+        """
+        embedding = None
+        if semantic_key is not None and self.semantic_cache is not None:
+            scope, query = semantic_key
+            embedding = self.semantic_cache.embed(query)
+            output = self.semantic_cache.get(scope, embedding)
+            if output is not None:
+                return output
+
+        output, key = None, None
+        if os.environ.get("PY2DATASET_CACHE") != "0":
+            key = hashlib.blake2b(
+                f"{self.llm_cache_model}\n{prompt}".encode(), digest_size=16
+            ).hexdigest()
+            output = read_llm_cache(key)
+        if output is None:
+            with self.llm_semaphore:  # bounds concurrent llm calls to max_concurrency
+                if self.model_config.get("stream"):
+                    output = join_stream(
+                        self.llm(prompt, stream=True),
+                        self.model_config.get("stream_repeat_limit", 5),
+                    )
+                else:
+                    output = self.llm(prompt)
+                output = BLANK_LINES_RE.sub("\n\n", output)
+            if key is not None:
+                write_llm_cache(key, output)
+
+        if embedding is not None:
+            self.semantic_cache.add(scope, embedding, output)
+        return output
+
     def get_response_from_llm(self, query: str, context: str) -> str:
         """
         Get language model response to query for given context.
@@ -181,89 +485,150 @@ class DatasetGenerator:
         Returns:
             str: The generated response.
         """
-        # List of dictionaries for Q and A pairs to be used as additional LLM context
-        excluded_instructions = ["Call code graph", "Docstring"]
-        code_qa_list = [
-            {item["instruction"].split(" in Python file:")[0]: item["output"]}
-            for item in self.instruct_list
-            if not any(
-                item["instruction"].startswith(prefix)
-                for prefix in excluded_instructions
-            )
-        ]
+        return self.complete_response(
+            self.get_overall_response(query, context, self.code_qa_list),
+            self.code_qa_list,
+        )
+
+    def get_overall_response(
+        self, query: str, context: str, code_qa_list: List[Dict[str, str]]
+    ) -> Tuple[str, str]:
+        """
+        Get the language model output for a query, without changing the generator,
+        so it can be called concurrently for deferred questions.
+        Args:
+            query (str): The query to be used for generating the response.
+            context (str): The context to be used for generating the response.
+            code_qa_list (List[Dict[str, str]]): The Q and A pairs to add to the context.
+        Returns:
+            Tuple[str, str]: The llm output, or None if the llm call failed, and the
+            context used in the prompt, or None if no context fits the context length.
+        """
+        # semantic cache hits are limited to the same code and only compare the query
+        semantic_key = (
+            (hashlib.blake2b(str(context).encode(), digest_size=16).hexdigest(), query)
+            if self.semantic_cache is not None
+            else None
+        )
 
         # Manage context length for LLM starting with the longest and most comprehensive
         context_strategies = [
             lambda: "```python\n{}\n```".format(str(context)),
+            lambda: "```python\n{}\n```".format(self.file_code_simplified),
             lambda: "```python\n{}\n```".format(
-                str(self.file_details["file_info"]["file_code_simplified"])
-            ),
-            lambda: "```python\n{}\n```".format(
-                self.get_string_from_info(
-                    self.file_details["file_info"], "file_summary"
-                )
+                self.get_string_from_info(self.file_info, "file_summary")
             ),
             lambda: "",
         ]
-        max_context_length = self.model_config["inference_model"]["model_params"][
-            "context_length"
-        ]
+        max_context_length = self.max_context_length
         for strategy in context_strategies:
             context = strategy()
             full_context = f"{context}\nCODE Q and A:\n{code_qa_list}"
             prompt = self.model_config["prompt_template"].format(
                 context=full_context, query=query
             )
+            # Skip tokenizing prompts too long to fit even at 4 characters per token
+            context_size = len(prompt) // 4
+            if context_size > max_context_length:
+                continue
             context_size = len(self.llm.tokenize(prompt))
             if context_size <= 0.70 * max_context_length:
                 break
-            else:
-                logging.error(
-                    f"Model response failed, increase py2dataset_model_config.yaml context_length > {math.ceil(context_size/0.70)}"
-                )
-                return ""
+        else:
+            logging.error(
+                "Model response failed, increase py2dataset_model_config.yaml context_length > %s",
+                math.ceil(context_size / 0.70),
+            )
+            return None, None
 
-        response = ""
         try:  # get response from LLM
-            response = re.sub(r"\n\s*\n", "\n\n", self.llm(prompt))
+            return self.get_llm_output(prompt, semantic_key), context
+        except Exception as error:
+            logging.error("Failed to generate model response: %s", error)
+            return None, context
+
+    def complete_response(
+        self, overall_response: Tuple[str, str], code_qa_list: List[Dict[str, str]]
+    ) -> str:
+        """
+        Complete an llm output from get_overall_response with the code elements and,
+        if detailed, rewrite the code_qa_list items with their purpose and significance.
+        Args:
+            overall_response (Tuple[str, str]): The llm output and the context used.
+            code_qa_list (List[Dict[str, str]]): The Q and A pairs the response is about.
+        Returns:
+            str: The generated response.
+        """
+        response, context = overall_response
+        if context is None:
+            return ""
+
+        if response is None:
+            response = ""
+        else:
             code_elements_combined = {}
             for item in code_qa_list:
                 code_elements_combined.update(item)
             code_elements_json = json.dumps(
-                {"Code Elements": code_elements_combined}, indent=4
-            )
-            code_elements_json = json.dumps(
-                group_json(json.loads(code_elements_json)), indent=4
+                group_json({"Code Elements": code_elements_combined}), indent=4
             )
             response += "\n" + code_elements_json  # Appending the JSON formatted string
-            logging.info(f"***Overall Response: {response}")
-
-        except Exception as error:
-            logging.error(f"Failed to generate model response: {error}")
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info("***Overall Response: %s", response)
 
         if self.detailed:  # Get llm response for each code_qa_list item
-            for item in code_qa_list:
-                instruct_key = list(item.keys())[0]
-                instruct_value = list(item.values())[0]
-                instruction = f"Describe the purpose and significance of these {instruct_key}: [{instruct_value}] within the code."
-                item_prompt = f"\n### Instruction:\nUsing this context:\n{context}\n\n{instruction}.\n### Response:"
-                try:
-                    item_response = re.sub(r"\n\s*\n", "\n\n", self.llm(item_prompt))
+            self.update_detailed_responses(context, code_qa_list)
+        return response
+
+    def update_detailed_responses(
+        self, context: str, code_qa_list: List[Dict[str, str]]
+    ) -> None:
+        """
+        Ask the language model the purpose and significance of each code_qa_list item
+        and add it to the item and its instruct_list output. The llm calls are made
+        concurrently if max_concurrency > 1, the updates are applied in this thread.
+        Args:
+            context (str): The context used for the overall response.
+            code_qa_list (List[Dict[str, str]]): The Q and A pairs to update.
+        Returns:
+            None
+        """
+
+        def get_item_response(item):
+            instruct_key, instruct_value = next(iter(item.items()))
+            instruction = f"Describe the purpose and significance of these {instruct_key}: [{instruct_value}] within the code."
+            # The shared context goes before the instruction so a backend that reuses the
+            # evaluated prefix of its previous prompt only evaluates the new instruction
+            item_prompt = f"\n### Instruction:\nUsing this context:\n{context}\n\n{instruction}.\n### Response:"
+            try:
+                item_response = self.get_llm_output(item_prompt)
+                if logging.getLogger().isEnabledFor(logging.INFO):
                     logging.info(
-                        f"\n***Itemized Response: {instruction}\n{item_response}"
+                        "\n***Itemized Response: %s\n%s", instruction, item_response
                     )
-                except Exception as error:
-                    logging.error(f"Failed to generate model response: {error}")
+                return item_response
+            except Exception as error:
+                logging.error("Failed to generate model response: %s", error)
+                return None
 
-                # replace the output value in self.instruct_list with the item.key + this_response
-                for i, instruct_item in enumerate(self.instruct_list):
-                    if instruct_item["instruction"].startswith(list(item.keys())[0]):
-                        instruct_item[
-                            "output"
-                        ] = f"{instruct_value}\n\nPurpose and Significance:\n{item_response}"
-                        break
+        code_qa_items = list(code_qa_list)
+        # only the llm calls run in the pool, the items are updated in this thread
+        if self.max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                item_responses = list(executor.map(get_item_response, code_qa_items))
+        else:
+            item_responses = map(get_item_response, code_qa_items)
 
-        return response
+        for item, item_response in zip(code_qa_items, item_responses):
+            if item_response is None:
+                continue
+            instruct_key, instruct_value = next(iter(item.items()))
+            # replace the output value in self.instruct_list with the item.key + this_response
+            for i, instruct_item in enumerate(self.instruct_list):
+                if instruct_item.instruction.startswith(instruct_key):
+                    instruct_item.output = f"{instruct_value}\n\nPurpose and Significance:\n{item_response}"
+                    item[instruct_key] = instruct_item.output
+                    break
 
     def process_question(
         self, question_type: str, question_id: str, query: str, context: str, info: Dict
@@ -279,27 +644,61 @@ class DatasetGenerator:
         Returns:
             None
         """
-        if question_id.endswith("code_graph") or question_id.endswith("docstring"):
+        if question_id.endswith(("code_graph", "docstring")):
             response = info.get(question_id, {})
         elif self.use_llm and question_id.endswith("purpose"):
+            if self.max_concurrency > 1:  # answered concurrently at the end of generate
+                self.deferred_questions.append(
+                    (
+                        question_type,
+                        query,
+                        context,
+                        len(self.instruct_list),
+                        len(self.code_qa_list),
+                    )
+                )
+                return
             response = self.get_response_from_llm(query, context)
         else:
             response = clean_and_get_unique_elements(str(info.get(question_id, "")))
+        self.add_response(question_type, query, context, response)
+
+    def add_response(
+        self,
+        question_type: str,
+        query: str,
+        context: str,
+        response,
+        position: Tuple[int, int] = None,
+    ) -> None:
+        """
+        Add a question response to the instruct_list.
+        Args:
+            question_type (str): The type of question that was processed.
+            query (str): The query that was processed.
+            context (str): The context used for generating the response.
+            response: The generated response.
+            position (Tuple[int, int]): The instruct_list and code_qa_list indexes to
+            insert the response at, the end of the lists if None.
+        Returns:
+            None
+        """
+        if not response or response == "None":
+            return
+        if not isinstance(response, str):
+            response = str(response)
+        response_str = response.strip()
+        if not response_str:
+            return
 
         if question_type == "file":
-            context = "".join(
-                [
-                    "```python\n",
-                    str(self.file_details["file_info"]["file_code"]),
-                    "\n```",
-                ]
+            context = self.file_code_context
+        index, qa_index = position or (len(self.instruct_list), len(self.code_qa_list))
+        self.instruct_list.insert(index, Instruct(query, context, response_str))
+        if not query.startswith(EXCLUDED_INSTRUCTIONS):
+            self.code_qa_list.insert(
+                qa_index, {query.split(" in Python file:")[0]: response_str}
             )
-        if response and response != "None":
-            response_str = str(response).strip()
-            if response_str:
-                self.instruct_list.append(
-                    {"instruction": query, "input": context, "output": response_str}
-                )
 
     @staticmethod
     def get_string_from_info(info, item_type):
@@ -316,6 +715,73 @@ class DatasetGenerator:
             return ", ".join(items)
         return ""
 
+    def get_question_targets(self) -> Dict[str, List[Tuple[Dict, str, Dict]]]:
+        """
+        Get the code elements each question type is asked about.
+        Args:
+            None
+        Returns:
+            Dict[str, List[Tuple[Dict, str, Dict]]]: The question text mapping,
+            context, and info of each code element by question type.
+        """
+        file_info = self.file_info
+        question_targets = {"file": [({}, file_info["file_code"], file_info)]}
+        for question_type in ["function", "class"]:
+            question_targets[question_type] = [
+                ({f"{question_type}_name": name}, info[f"{question_type}_code"], info)
+                for name, info in self.file_details[
+                    self.question_mapping[question_type]
+                ].items()
+            ]
+        question_targets["method"] = [
+            (
+                {
+                    "class_name": class_name,
+                    "method_name": f"{class_name}.{key[len('class_method_'):]}",
+                },
+                method_info["method_code"],
+                method_info,
+            )
+            for class_name, class_info in self.file_details["classes"].items()
+            for key, method_info in class_info.items()
+            if key.startswith("class_method_")
+        ]
+        return question_targets
+
+    def get_purpose_string(
+        self, question_type: str, name: str, info: Dict, field: str
+    ) -> str:
+        """
+        Get the variables or methods string of a function or class for purpose
+        questions, computed once per code element.
+        Args:
+            question_type (str): The type of question, 'function' or 'class'.
+            name (str): The name of the function or class.
+            info (Dict): The information of the function or class.
+            field (str): 'variables' or 'methods'.
+        Returns:
+            str: The string for the purpose question text.
+        """
+        key = (question_type, name, field)
+        if key not in self.purpose_strings:
+            if field == "methods":
+                purpose_string = self.get_string_from_info(
+                    info, f"{question_type}_methods"
+                )
+            else:
+                variables_string = self.get_string_from_info(
+                    info, f"{question_type}_variables"
+                )
+                inputs_string = self.get_string_from_info(
+                    info, f"{question_type}_inputs"
+                )
+                combined_string = ", ".join(
+                    [s for s in [variables_string, inputs_string] if s]
+                )
+                purpose_string = clean_and_get_unique_elements(combined_string)
+            self.purpose_strings[key] = purpose_string
+        return self.purpose_strings[key]
+
     def process_question_type(
         self, question_type: str, question_id: str, question_text: str
     ) -> None:
@@ -328,63 +794,76 @@ class DatasetGenerator:
         Returns:
             None
         """
-        if question_type == "file":
-            query = question_text.format(filename=self.base_name)
-            info = self.file_details["file_info"]
-            context = self.file_details["file_info"]["file_code"]
-            self.process_question(question_type, question_id, query, context, info)
-        elif question_type == "method":
-            for class_name, class_info in self.file_details["classes"].items():
-                for key, method_info in class_info.items():
-                    if key.startswith("class_method_"):
-                        method_name = f"{class_name}.{key[len('class_method_'):]}"
-                        context = method_info["method_code"]
-                        mapping = {"class_name": class_name, "method_name": method_name}
-                        query = question_text.format(filename=self.base_name, **mapping)
-                        self.process_question(
-                            question_type, question_id, query, context, method_info
-                        )
-        else:  # question_type is 'function' or 'class'
-            for name, info in self.file_details[
-                self.question_mapping[question_type]
-            ].items():
-                context = info[f"{question_type}_code"]
-                mapping = {f"{question_type}_name": name}
-                if question_id == f"{question_type}_purpose" and self.use_llm:
-                    variables_string = self.get_string_from_info(
-                        info, f"{question_type}_variables"
-                    )
-                    inputs_string = self.get_string_from_info(
-                        info, f"{question_type}_inputs"
+        fields = get_question_fields(question_text)
+        # question text without replacement fields is the same query for every target
+        static_query = None if fields else question_text.format()
+        for mapping, context, info in self.question_targets[question_type]:
+            if (
+                question_type in ("function", "class")
+                and question_id == f"{question_type}_purpose"
+                and self.use_llm
+            ):
+                mapping = dict(mapping)
+                name = mapping[f"{question_type}_name"]
+                # only build the strings the question text uses
+                if f"{question_type}_variables" in fields:
+                    mapping[f"{question_type}_variables"] = self.get_purpose_string(
+                        question_type, name, info, "variables"
                     )
-                    combined_string = ", ".join(
-                        [s for s in [variables_string, inputs_string] if s]
+                if question_type == "class" and "class_methods" in fields:
+                    mapping[f"{question_type}_methods"] = self.get_purpose_string(
+                        question_type, name, info, "methods"
                     )
-                    mapping[
-                        f"{question_type}_variables"
-                    ] = clean_and_get_unique_elements(combined_string)
-
-                    if question_type == "class":
-                        methods_string = self.get_string_from_info(
-                            info, f"{question_type}_methods"
-                        )
-                        mapping[f"{question_type}_methods"] = methods_string
 
-                query = question_text.format(filename=self.base_name, **mapping)
-                self.process_question(question_type, question_id, query, context, info)
+            query = static_query or question_text.format(
+                filename=self.base_name, **mapping
+            )
+            self.process_question(question_type, question_id, query, context, info)
 
-    def generate(self) -> Tuple[List[Dict], List[Dict]]:
+    def generate(self) -> List[Instruct]:
         """
         Generate responses for all the questions and returns the instruct_list.
         Args:
             None
         Returns:
-            Tuple[List[Dict], List[Dict]]: The generated question-answer pairs and instructions.
+            List[Instruct]: The generated instructions.
         """
         for question in self.questions:
             self.process_question_type(
                 question["type"], question["id"], question["text"]
             )
+        if self.deferred_questions:  # submit the longest contexts first
+            order = sorted(
+                range(len(self.deferred_questions)),
+                key=lambda i: -len(str(self.deferred_questions[i][2])),
+            )
+            futures = {}
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for i in order:
+                    _, query, context, _, qa_index = self.deferred_questions[i]
+                    futures[i] = executor.submit(
+                        self.get_overall_response,
+                        query,
+                        context,
+                        self.code_qa_list[:qa_index],
+                    )
+            # complete and add the responses one at a time in question order, each at
+            # the position it would have been added at with a max_concurrency of 1
+            added, added_qa = 0, 0
+            for i, (question_type, query, context, index, qa_index) in enumerate(
+                self.deferred_questions
+            ):
+                qa_index += added_qa
+                response = self.complete_response(
+                    futures[i].result(), self.code_qa_list[:qa_index]
+                )
+                count, qa_count = len(self.instruct_list), len(self.code_qa_list)
+                self.add_response(
+                    question_type, query, context, response, (index + added, qa_index)
+                )
+                added += len(self.instruct_list) - count
+                added_qa += len(self.code_qa_list) - qa_count
+            self.deferred_questions = []
         return self.instruct_list
 
 
@@ -395,9 +874,9 @@ def get_python_datasets(
     questions: List[Dict],
     model_config: Dict,
     detailed: bool,
-) -> Tuple[List[Dict], List[Dict]]:
+) -> List[Instruct]:
     """
-    Extract information from a Python file and return it in JSON format.
+    Extract information from a Python file and return it as Instruct records.
     Args:
         file_path (str): The path to the Python file.
         file_details (Dict): The details of the file.
@@ -407,7 +886,7 @@ def get_python_datasets(
         prompt (str): The prompt to be used for generating responses.
         detailed (bool): Flag indicating if detailed information should be extracted.
     Returns:
-        Tuple[List[Dict], List[Dict]]: Extracted information in JSON format.
+        List[Instruct]: The extracted instructions, written to JSON by save_output.
     """
     return DatasetGenerator(
         file_path, file_details, base_name, questions, model_config, detailed
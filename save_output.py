@@ -30,6 +30,7 @@ Requirements:
 """
 import json
 import logging
+from dataclasses import asdict
 from html import escape
 from pathlib import Path
 from typing import Dict, List
@@ -67,7 +68,8 @@ def write_file(data: Dict, file_path: Path) -> None:
     file_type = file_path.suffix[1:]
     with file_path.open("w") as f:
         if file_type == "json":
-            json.dump(data, f, indent=4)
+            # dataclass records, such as Instruct, are converted as they are written
+            json.dump(data, f, indent=4, default=asdict)
         elif file_type == "yaml":
             yaml.SafeDumper.ignore_aliases = lambda *args: True
             yaml.dump(data, f, Dumper=yaml.SafeDumper, sort_keys=False)
@@ -277,7 +279,7 @@ def save_python_data(
     Save Python file details as a YAML file, the instruction data as a JSON file, and code graphs.
     Args:
         file_details (dict): The details extracted from the Python file.
-        instruct_list (list): The instruction data extracted from the Python file.
+        instruct_list (list): The Instruct records extracted from the Python file.
         relative_path (Path): The relative path to the Python file.
         output_dir (str): The directory where the output files will be saved.
     Returns: